@@ -161,6 +161,36 @@ report_seq_no = 0
 # device state variables
 led_state_onoff = False  # LED off
 sw_state_onoff = False  # plain switch off
+
+# in-clusters per endpoint, as registered with af_register above
+endpoint_in_clusters = {1: (b'\x00\x00', b'\x00\x06'),
+                        2: (b'\x00\x00', b'\x00\x06')}
+
+
+def get_cluster_provider(endpoint, cluster_id, manufacturer_code):
+    """
+    The attribute provider for a Read or Discover Attributes command, or None if the endpoint does not have that cluster
+    (or has no attribute set for that manufacturer code)
+    :param endpoint: int
+    :param cluster_id: big-endian cluster id
+    :param manufacturer_code: big-endian code from a manufacturer-specific frame, or None
+    """
+    if cluster_id not in endpoint_in_clusters.get(endpoint, ()):
+        return None
+    provider_class = znp.CLUSTER_PROVIDERS.get((cluster_id, manufacturer_code))
+    if provider_class is znp.BasicClusterAttributeParts:
+        return provider_class(model_identifier="ZNP-Test")
+    if provider_class is znp.OnOffReadAttributeParts:
+        # this cluster is on two endpoints
+        return provider_class(sw_state_onoff if endpoint == 1 else led_state_onoff)  # plain switch or LED state
+    return None
+
+
+def unsupported_cluster_message(endpoint, cluster_id, manufacturer_code):
+    return "Unsupported cluster {} on endpoint {}{}; cannot respond".format(
+        cluster_id.hex(), endpoint, "" if manufacturer_code is None else " for manufacturer code " + manufacturer_code.hex())
+
+
 while running:
     # check for incoming messages which correspond to the Z2M "interview"
     if S.inWaiting():
@@ -177,6 +207,9 @@ while running:
             print("Incoming ZCL for endpoint {}, cluster id = {} is: {}".format(in_msg.dst_endpoint[0],
                                                                                 in_msg.cluster_id.hex(),
                                                                                 in_msg.zcl_raw.hex(" ")))
+            if in_msg.zcl is None:
+                print("Malformed ZCL; cannot respond:", in_msg.zcl_error)
+                continue
             if in_msg.zcl.frame_control == b'\x01':  # This is a command "local or specific to a cluster". e.g. a plain on/off command to cluster 6
                 # also 0x01 indicates the default repsonse is not disabled. Ideally, this should be treated properly, but path of least action...
                 print("Local/specific command to cluster", in_msg.cluster_id.hex())
@@ -201,22 +234,32 @@ while running:
 
             elif in_msg.zcl.zcl_command == b'\x00':  # Read Attributes
                 print("ZCL Command = read attributes (0x00)")
-                cluster_provider = None
-                if in_msg.cluster_id == b'\x00\x00':
-                    cluster_provider = znp.BasicClusterAttributeParts(model_identifier="ZNP-Test")
-                elif in_msg.cluster_id == b'\x00\x06':
-                    # this cluster is on two endpoints ([0] gets int value of first and only byte), so:
-                    if in_msg.dst_endpoint[0] == 1:  # plain switch
-                        cluster_provider = znp.OnOffReadAttributeParts(sw_state_onoff)
-                    elif in_msg.dst_endpoint[0] == 2:  # LED state
-                        cluster_provider = znp.OnOffReadAttributeParts(led_state_onoff)                    
-
+                # [0] gets int value of first and only byte
+                cluster_provider = get_cluster_provider(in_msg.dst_endpoint[0], in_msg.cluster_id, in_msg.zcl.manufacturer_code)
                 if cluster_provider is None:
-                    print("Unsupported cluster {}; cannot respond".format(in_msg.cluster_id.hex()))
+                    print(unsupported_cluster_message(in_msg.dst_endpoint[0], in_msg.cluster_id, in_msg.zcl.manufacturer_code))
                     continue
 
                 data = znp.ZclFrameReadAttributesResponse(response_to=in_msg.zcl, cluster_provider=cluster_provider).zcl_message()
 
+            elif in_msg.zcl.zcl_command in (b'\x0c', b'\x15'):  # Discover Attributes (0x0c) or Discover Attributes Extended (0x15)
+                print("ZCL Command = discover attributes ({})".format(in_msg.zcl.zcl_command.hex()))
+                try:
+                    discover = znp.ZclFrameDiscoverAttributes(in_msg.zcl_raw)
+                except ValueError as e:
+                    print(e)
+                    continue
+                cluster_provider = get_cluster_provider(in_msg.dst_endpoint[0], in_msg.cluster_id, discover.manufacturer_code)
+                if cluster_provider is None:
+                    print(unsupported_cluster_message(in_msg.dst_endpoint[0], in_msg.cluster_id, discover.manufacturer_code))
+                    continue
+
+                data = znp.ZclFrameDiscoverAttributesResponse(response_to=discover, attribute_index=cluster_provider.attribute_index).zcl_message()
+
+            else:
+                print("Unsupported ZCL command {}".format(in_msg.zcl.zcl_command.hex()))
+                continue
+
             # AF_DATA_REQUEST 0x2401
             print("Sending response...")
             out_msg = (10 + len(data)).to_bytes(length=1, byteorder="big") + znp.AF_DATA_REQUEST + \
@@ -0,0 +1,344 @@
+"""
+Soak / load harness for the znp I/O functions, run over a Linux pseudo-terminal instead of a real CC2530.
+
+One end of the pty pair is driven by a scripted stand-in for the ZNP (playing the part of the coordinator sending
+AF_INCOMING_MSG read-attribute requests, and answering each AF_DATA_REQUEST with AF_DATA_REQUEST_RSP + AF_DATA_CONFIRM).
+The other end is opened with a real pyserial Serial in a separate process, which runs a loop like the one in main.py using the
+unmodified znp functions. The offered load is stepped up until the device side saturates, and for each step we print
+response latency (p50/p99), throughput, FCS errors and drops.
+
+Linux only (needs os.openpty). Example:
+    python soak.py --start-rate 20 --max-rate 5000 --duration 5 --csv soak.csv
+"""
+import argparse
+import math
+import multiprocessing
+import os
+import threading
+from collections import deque
+from time import perf_counter, sleep
+
+from serial import Serial
+import znp
+
+AF_DATA_CONFIRM = b'\x44\x80'
+
+# device-side counters, shared with the harness process. indexes into the multiprocessing.Array
+DEV_FRAMES_RX = 0
+DEV_FCS_ERRORS = 1
+DEV_RSP_FAILURES = 2  # AF_DATA_REQUEST which did not get a successful AF_DATA_REQUEST_RSP as the very next frame
+DEV_UNEXPECTED = 3  # frames which were neither AF_INCOMING_MSG (with valid ZCL) nor AF_DATA_CONFIRM (e.g. a RSP which arrived "late")
+DEV_COUNTERS = 4
+
+# read attributes requested for the Basic Cluster, as Z2M does during the interview. little-endian, as on the wire
+BASIC_ATTRIBUTES_LE = b'\x04\x00' + b'\x05\x00' + b'\x07\x00'
+# an unsupported attribute id, 0xffnn, is also requested, where nn is the step (epoch) number. The device echoes it as the last part
+# of its response (with status 0x86) so that late responses to a previous step are not matched to this step's requests
+EPOCH_ATTRIBUTE_HI = 0xff
+MAX_REQUESTS_PER_STEP = 65536  # request numbers are carried in the 8 bit AF transaction id + 8 bit ZCL sequence no
+
+
+def device_loop(port, ready, stop, counters):
+    """
+    The device under test: reads frames from the serial port and responds to read attributes much as main.py does.
+    Runs in its own process so that the busy inWaiting() poll does not steal the GIL from the stand-in.
+    :param port: device name of the pty slave
+    :param ready: set once the port is open (and so in raw mode) and flushed
+    :type ready: multiprocessing.Event
+    :param stop: set by the harness when the device should exit
+    :type stop: multiprocessing.Event
+    :param counters: see DEV_* indexes
+    :type counters: multiprocessing.Array
+    """
+    s = Serial(port=port, baudrate=115200)  # default timeout is forever, as for main.py
+    s.reset_input_buffer()
+    ready.set()
+    cluster_provider = znp.BasicClusterAttributeParts(model_identifier="ZNP-Soak")
+
+    while not stop.is_set():
+        if not s.inWaiting():
+            continue
+        f = znp.ZnpFrameBody(s)
+        counters[DEV_FRAMES_RX] += 1
+        if not f.fcs_ok:
+            counters[DEV_FCS_ERRORS] += 1
+            continue
+        if f.command == AF_DATA_CONFIRM:
+            continue
+
+        in_msg = znp.AfIncomingMessage(f)
+        if not in_msg.is_af_incoming_message or in_msg.zcl is None:
+            counters[DEV_UNEXPECTED] += 1
+            continue
+
+        data = znp.ZclFrameReadAttributesResponse(response_to=in_msg.zcl, cluster_provider=cluster_provider).zcl_message()
+        # AF_DATA_REQUEST 0x2401, exactly as main.py
+        out_msg = (10 + len(data)).to_bytes(length=1, byteorder="big") + znp.AF_DATA_REQUEST + \
+            in_msg.src_addr + in_msg.src_endpoint + in_msg.dst_endpoint + in_msg.cluster_id[::-1] + in_msg.transaction_seq_no + b'\x00' + b'\x10' + \
+            len(data).to_bytes(length=1, byteorder="big") + data
+        if not znp.send_and_check_success(s, out_msg, znp.AF_DATA_REQUEST_RSP):
+            counters[DEV_RSP_FAILURES] += 1
+
+    s.close()
+
+
+def frame(command, data):
+    """
+    Full UART frame, from SOF to FCS inclusive
+    :param command: 2 byte command id
+    :param data:
+    :return: bytes
+    """
+    return b'\xfe' + znp.calc_append_fcs(len(data).to_bytes(length=1, byteorder="big") + command + data)
+
+
+def af_incoming_msg(request_no, epoch):
+    """
+    AF_INCOMING_MSG carrying a read attributes request for the Basic Cluster on endpoint 1.
+    The request number is split across the AF transaction id (low byte) and the ZCL sequence number (high byte), both of which
+    the device echoes in its AF_DATA_REQUEST, so that responses can be matched to requests even with >256 outstanding.
+    :param request_no: 0 .. 65535
+    :param epoch: 0 .. 255, see EPOCH_ATTRIBUTE_HI
+    :return: full UART frame
+    """
+    zcl = b'\x00' + ((request_no >> 8) & 0xff).to_bytes(1, "big") + b'\x00' + BASIC_ATTRIBUTES_LE + bytes([epoch, EPOCH_ATTRIBUTE_HI])
+    data = b'\x00\x00' + b'\x00\x00' + b'\x00\x00' + b'\x01' + b'\x01' + b'\x00' + b'\xff' + b'\x00' + b'\x00\x00\x00\x00' + \
+        (request_no & 0xff).to_bytes(1, "big") + len(zcl).to_bytes(1, "big") + zcl + b'\x00\x00\x00'
+    return frame(znp.AF_INCOMING_MSG, data)
+
+
+class ZnpStandIn:
+    """
+    Scripted stand-in for the ZNP + coordinator on the pty master. Writes AF_INCOMING_MSG at a requested rate and answers
+    every AF_DATA_REQUEST; records the time at which each request was sent and its response seen.
+    """
+    def __init__(self, master_fd):
+        self.fd = master_fd
+        # All writes go through one output thread, so that the reader never blocks on a full pty (which would stop it draining
+        # the device's writes, and deadlock). Responses to the device jump the queue of offered load, as on a real ZNP.
+        self.out_ready = threading.Condition()
+        self.out_responses = deque()
+        self.out_load = deque()
+        self.epoch = 0  # step number, modulo 256
+        self.sent = {}  # request number -> time offered
+        self.answered = {}  # request number -> latency in seconds
+        self.offer_start = None  # time of the first send of the current step
+        self.last_answered = None  # time the last response of the current step was seen
+        self.fcs_errors = 0
+        self.running = True
+        self.reader = threading.Thread(target=self._read_loop, daemon=True)
+        self.reader.start()
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def _write(self, b, load=False):
+        with self.out_ready:
+            (self.out_load if load else self.out_responses).append(b)
+            self.out_ready.notify()
+
+    def _write_loop(self):
+        while self.running:
+            with self.out_ready:
+                while not (self.out_responses or self.out_load):
+                    self.out_ready.wait()
+                b = self.out_responses.popleft() if self.out_responses else self.out_load.popleft()
+            try:
+                os.write(self.fd, b)
+            except OSError:
+                return
+
+    def _read_loop(self):
+        buf = b''
+        confirm_trans_id = 0
+        while self.running:
+            try:
+                chunk = os.read(self.fd, 4096)
+            except OSError:  # EIO once the slave side has gone
+                return
+            t = perf_counter()
+            buf += chunk
+            while True:
+                sof = buf.find(b'\xfe')
+                if sof < 0:
+                    buf = b''
+                    break
+                buf = buf[sof:]
+                if len(buf) < 2 or len(buf) < buf[1] + 5:
+                    break  # partial frame; wait for more
+                data_length = buf[1]
+                body = buf[1:4 + data_length]
+                if znp.calc_append_fcs(body)[-1] != buf[4 + data_length]:
+                    self.fcs_errors += 1
+                    buf = buf[1:]  # resync on the next SOF
+                    continue
+                buf = buf[5 + data_length:]
+                command = body[1:3]
+                data = body[3:]
+                if command != znp.AF_DATA_REQUEST:
+                    continue
+                self._write(frame(znp.AF_DATA_REQUEST_RSP, b'\x00'))
+                # the ZCL follows the 10 byte AF_DATA_REQUEST header; its 2nd byte is the echoed ZCL sequence no and it ends with
+                # the epoch attribute id + UNSUPPORTED_ATTRIBUTE status
+                zcl = data[10:10 + data[9]]
+                request_no = (zcl[1] << 8) | data[6]
+                sent = self.sent.get(request_no) if zcl[-3:] == bytes([self.epoch, EPOCH_ATTRIBUTE_HI, 0x86]) else None
+                if sent is not None and request_no not in self.answered:
+                    self.answered[request_no] = t - sent
+                    self.last_answered = t
+                # status, endpoint, trans id
+                self._write(frame(AF_DATA_CONFIRM, b'\x00' + data[3:4] + confirm_trans_id.to_bytes(1, "big")))
+                confirm_trans_id = (confirm_trans_id + 1) % 256
+
+    def offer(self, rate, duration):
+        """
+        Send AF_INCOMING_MSG at a fixed rate, paced against the clock (not against responses), for the given duration.
+        :param rate: messages per second
+        :param duration: seconds
+        """
+        n = int(rate * duration)
+        if n > MAX_REQUESTS_PER_STEP:
+            raise ValueError(f"{n} requests in one step; at most {MAX_REQUESTS_PER_STEP} can be told apart")
+        self.epoch = (self.epoch + 1) % 256  # before clearing, so that late responses from the previous step no longer match
+        self.sent.clear()
+        self.answered.clear()
+        self.last_answered = None
+        t0 = self.offer_start = perf_counter()
+        for i in range(n):
+            due = t0 + i / rate
+            delay = due - perf_counter()
+            if delay > 0:
+                sleep(delay)
+            self.sent[i] = perf_counter()
+            self._write(af_incoming_msg(i, self.epoch), load=True)
+
+    def discard_backlog(self):
+        """
+        Drop offered messages which were never written to the pty, so that they do not spill into the next step.
+        :return: number discarded
+        """
+        with self.out_ready:
+            n = len(self.out_load)
+            self.out_load.clear()
+            return n
+
+
+def percentile(values, p):
+    """
+    :param values: sorted list
+    :param p: 0..100
+    :return: nearest-rank percentile, or None if no values
+    """
+    if not values:
+        return None
+    k = max(0, math.ceil(p / 100 * len(values)) - 1)
+    return values[k]
+
+
+def run(rates, duration, drain, saturation_ratio):
+    """
+    Step through offered loads, stopping at the first step which saturates.
+    :return: list of dict, one per step
+    """
+    master_fd, slave_fd = os.openpty()
+    port = os.ttyname(slave_fd)
+
+    ready = multiprocessing.Event()
+    stop = multiprocessing.Event()
+    counters = multiprocessing.Array('L', DEV_COUNTERS)
+    device = multiprocessing.Process(target=device_loop, args=(port, ready, stop, counters), daemon=True)
+    device.start()
+    # until pyserial has opened the slave it is in cooked mode, where ECHO and ICRNL would mangle the stand-in's frames
+    if not ready.wait(timeout=10):
+        device.terminate()
+        os.close(slave_fd)
+        os.close(master_fd)
+        raise RuntimeError("Device process did not open " + port)
+
+    stand_in = ZnpStandIn(master_fd)
+    results = []
+    try:
+        for rate in rates:
+            before = counters[:]
+            fcs_before = stand_in.fcs_errors
+            stand_in.offer(rate, duration)
+            sleep(drain)  # allow late responses before counting drops
+            unsent = stand_in.discard_backlog()
+            after = counters[:]
+
+            latencies = sorted(stand_in.answered.values())
+            sent = len(stand_in.sent)
+            answered = len(latencies)
+            row = {
+                "offered": rate,
+                "sent": sent,
+                "answered": answered,
+                # responses seen in the drain window count too, so divide by the time over which they were actually served
+                "throughput": 0.0 if not answered else answered / (stand_in.last_answered - stand_in.offer_start),
+                "p50_ms": None if not latencies else percentile(latencies, 50) * 1000,
+                "p99_ms": None if not latencies else percentile(latencies, 99) * 1000,
+                "drops": sent - answered,
+                "unsent": unsent,
+                "fcs_device": after[DEV_FCS_ERRORS] - before[DEV_FCS_ERRORS],
+                "fcs_stand_in": stand_in.fcs_errors - fcs_before,
+                "rsp_failures": after[DEV_RSP_FAILURES] - before[DEV_RSP_FAILURES],
+                "unexpected": after[DEV_UNEXPECTED] - before[DEV_UNEXPECTED],
+            }
+            results.append(row)
+            print_row(row)
+            if answered < saturation_ratio * sent:
+                print(f"Saturated at offered load {rate}/s")
+                break
+    finally:
+        stop.set()
+        stand_in.running = False
+        device.join(timeout=2)
+        if device.is_alive():  # most likely blocked mid-frame in ZnpFrameBody
+            device.terminate()
+        os.close(slave_fd)
+        os.close(master_fd)
+
+    return results
+
+
+COLUMNS = ("offered", "sent", "answered", "throughput", "p50_ms", "p99_ms", "drops", "unsent", "fcs_device", "fcs_stand_in", "rsp_failures", "unexpected")
+
+
+def print_header():
+    print(" ".join(f"{c:>12}" for c in COLUMNS))
+
+
+def print_row(row):
+    print(" ".join(f"{'-':>12}" if row[c] is None else f"{row[c]:>12.2f}" if isinstance(row[c], float) else f"{row[c]:>12}" for c in COLUMNS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PTY-backed soak/load test of the znp serial I/O functions")
+    parser.add_argument("--start-rate", type=float, default=10, help="first offered load, AF_INCOMING_MSG per second")
+    parser.add_argument("--max-rate", type=float, default=5000, help="last offered load to try, if not saturated before")
+    parser.add_argument("--step", type=float, default=2, help="multiplier between offered loads")
+    parser.add_argument("--duration", type=float, default=5, help="seconds per step")
+    parser.add_argument("--drain", type=float, default=1, help="seconds to wait for late responses after each step")
+    parser.add_argument("--saturation", type=float, default=0.9, help="stop once fewer than this fraction of requests are answered")
+    parser.add_argument("--csv", help="also write the curves to this file")
+    args = parser.parse_args()
+
+    rates = []
+    rate = args.start_rate
+    while rate <= args.max_rate:
+        rates.append(rate)
+        rate *= args.step
+    if rates and rates[-1] * args.duration > MAX_REQUESTS_PER_STEP:
+        parser.error(f"--max-rate x --duration must be at most {MAX_REQUESTS_PER_STEP} requests per step")
+
+    print_header()
+    results = run(rates, args.duration, args.drain, args.saturation)
+
+    if args.csv:
+        with open(args.csv, "w") as f:
+            f.write(",".join(COLUMNS) + "\n")
+            for row in results:
+                f.write(",".join("" if row[c] is None else str(row[c]) for c in COLUMNS) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,7 @@
+import struct
+from bisect import bisect_left
+from functools import lru_cache
+
 from serial import Serial
 
 # ZNP message command ids
@@ -20,18 +24,403 @@ AF_DATA_REQUEST = b'\x24\x01'
 AF_DATA_REQUEST_RSP = b'\x64\x01'
 
 
-class BasicClusterAttributeParts:
+# ZCL data type ids (ZCL spec 2.6.2). These are ints; use zcl_type_byte() for the byte form as in frames
+ZCL_DATA8, ZCL_DATA16, ZCL_DATA24, ZCL_DATA32, ZCL_DATA40, ZCL_DATA48, ZCL_DATA56, ZCL_DATA64 = range(0x08, 0x10)
+ZCL_BOOLEAN = 0x10
+ZCL_BITMAP8, ZCL_BITMAP16, ZCL_BITMAP24, ZCL_BITMAP32, ZCL_BITMAP40, ZCL_BITMAP48, ZCL_BITMAP56, ZCL_BITMAP64 = range(0x18, 0x20)
+ZCL_UINT8, ZCL_UINT16, ZCL_UINT24, ZCL_UINT32, ZCL_UINT40, ZCL_UINT48, ZCL_UINT56, ZCL_UINT64 = range(0x20, 0x28)
+ZCL_INT8, ZCL_INT16, ZCL_INT24, ZCL_INT32, ZCL_INT40, ZCL_INT48, ZCL_INT56, ZCL_INT64 = range(0x28, 0x30)
+ZCL_ENUM8 = 0x30
+ZCL_ENUM16 = 0x31
+ZCL_SEMI_FLOAT = 0x38
+ZCL_SINGLE_FLOAT = 0x39
+ZCL_DOUBLE_FLOAT = 0x3a
+ZCL_OCTET_STRING = 0x41
+ZCL_CHAR_STRING = 0x42
+ZCL_LONG_OCTET_STRING = 0x43
+ZCL_LONG_CHAR_STRING = 0x44
+ZCL_ARRAY = 0x48
+ZCL_STRUCT = 0x4c
+
+
+@lru_cache(maxsize=64)
+def _zcl_struct_many(fmt, count):
     """
-    Produces the byte sequences for a Read Attributes Response Command, including the attribute identifier, status, data type, and value
+    struct.Struct for count values of one format character. Bounded, since arrays may have up to 65535 elements
     """
-    cluster_id = b'\x00\x00'
-    supported_attributes = (b'\x00\x00', b'\x00\x04', b'\x00\x05', b'\x00\x07', b'\x40\x00')
+    return struct.Struct("<{}{}".format(count, fmt))
 
-    def __init__(self, model_identifier, manufacturer_name="ARC12", sw_build="test-build"):
-        # TODO allow more customisation here.
-        self.model_identifier = model_identifier
-        self.manufacturer_name = manufacturer_name
-        self.sw_build = sw_build
+
+def _zcl_check_length(data, end, name):
+    """
+    :raises ValueError: if data is too short to hold a value (or header) ending at end
+    """
+    if end > len(data):
+        raise ValueError("ZCL {} truncated: needs {} bytes, have {}".format(name, end, len(data)))
+
+
+class ZclFixedType:
+    """
+    Codec for a fixed-length ZCL data type (integers, enums, bitmaps, floats, boolean). All ZCL values are little-endian.
+    Widths which struct has a format character for use a pre-compiled struct.Struct; 24/40/48/56 bit values use int.to/from_bytes.
+    """
+    def __init__(self, type_id, name, size, fmt=None, signed=False):
+        """
+
+        :param type_id: ZCL data type id
+        :type type_id: int
+        :param size: length of the value in bytes
+        :param fmt: struct format character, or None for the odd widths
+        :param signed: only used for the odd widths
+        """
+        self.type_id = type_id
+        self.name = name
+        self.size = size
+        self.fmt = fmt
+        self.signed = signed
+        self.struct = struct.Struct("<" + fmt) if fmt else None
+
+    def _struct_many(self, count):
+        return _zcl_struct_many(self.fmt, count)
+
+    def encode(self, value):
+        """
+        :return: the value alone (no type byte) as bytes
+        :raises ValueError: if the value does not fit the type
+        """
+        try:
+            if self.struct:
+                return self.struct.pack(value)
+            return value.to_bytes(self.size, "little", signed=self.signed)
+        except (struct.error, OverflowError, AttributeError, TypeError) as e:  # AttributeError: e.g. a float has no to_bytes
+            raise ValueError("{!r} does not fit ZCL type {}: {}".format(value, self.name, e)) from None
+
+    def decode(self, data, offset=0):
+        """
+        :param data: bytes containing the value (no type byte) at offset
+        :return: (value, offset after the value)
+        """
+        end = offset + self.size
+        _zcl_check_length(data, end, self.name)
+        if self.struct:
+            return self.struct.unpack_from(data, offset)[0], end
+        return int.from_bytes(data[offset:end], "little", signed=self.signed), end
+
+    def encode_many(self, values):
+        """
+        Encode a sequence of values of this type back-to-back, in one struct call where possible
+        :raises ValueError: if any value does not fit the type
+        """
+        try:
+            if self.struct:
+                return self._struct_many(len(values)).pack(*values)
+            return b''.join(v.to_bytes(self.size, "little", signed=self.signed) for v in values)
+        except (struct.error, OverflowError, AttributeError, TypeError) as e:
+            raise ValueError("value does not fit ZCL type {}: {}".format(self.name, e)) from None
+
+    def decode_many(self, data, count, offset=0):
+        """
+        :return: (list of values, offset after the last value)
+        """
+        end = offset + count * self.size
+        _zcl_check_length(data, end, self.name)
+        if self.struct:
+            return list(self._struct_many(count).unpack_from(data, offset)), end
+        return [int.from_bytes(data[i:i + self.size], "little", signed=self.signed) for i in range(offset, end, self.size)], end
+
+
+class ZclStringType:
+    """
+    Codec for octet and character strings, which are prefixed by a 1 byte (short) or 2 byte (long) length.
+    An all-ones length is the "invalid" value and decodes to None.
+    """
+    def __init__(self, type_id, name, length_size, is_char):
+        self.type_id = type_id
+        self.name = name
+        self.length_struct = struct.Struct("<B" if length_size == 1 else "<H")
+        self.invalid_length = 0xff if length_size == 1 else 0xffff
+        self.is_char = is_char
+
+    def encode(self, value):
+        if value is None:
+            return self.length_struct.pack(self.invalid_length)
+        raw = value.encode(encoding="ascii") if self.is_char else bytes(value)
+        if len(raw) >= self.invalid_length:
+            raise ValueError("{} bytes is too long for ZCL type {}".format(len(raw), self.name))
+        return self.length_struct.pack(len(raw)) + raw
+
+    def decode(self, data, offset=0):
+        _zcl_check_length(data, offset + self.length_struct.size, self.name)
+        length = self.length_struct.unpack_from(data, offset)[0]
+        offset += self.length_struct.size
+        if length == self.invalid_length:
+            return None, offset
+        _zcl_check_length(data, offset + length, self.name)
+        raw = bytes(data[offset:offset + length])
+        return (raw.decode(encoding="ascii") if self.is_char else raw), offset + length
+
+    def encode_many(self, values):
+        return b''.join(self.encode(v) for v in values)
+
+    def decode_many(self, data, count, offset=0):
+        values = []
+        for _ in range(count):
+            v, offset = self.decode(data, offset)
+            values.append(v)
+        return values, offset
+
+
+class ZclBooleanType(ZclFixedType):
+    """
+    Codec for boolean: 0x00 is False, 0x01 is True and 0xff is the "invalid" value, which maps to/from None. Others are rejected
+    """
+    _encoded = {False: b'\x00', True: b'\x01', None: b'\xff'}
+    _decoded = {0x00: False, 0x01: True, 0xff: None}
+
+    def __init__(self):
+        super(ZclBooleanType, self).__init__(ZCL_BOOLEAN, "boolean", 1)
+
+    def encode(self, value):
+        if value is not None and value not in (0, 1):  # True/False compare equal to 1/0
+            raise ValueError("{!r} does not fit ZCL type boolean".format(value))
+        return self._encoded[None if value is None else bool(value)]
+
+    def decode(self, data, offset=0):
+        _zcl_check_length(data, offset + 1, self.name)
+        try:
+            return self._decoded[data[offset]], offset + 1
+        except KeyError:
+            raise ValueError("0x{:02x} is not a ZCL boolean".format(data[offset])) from None
+
+    def encode_many(self, values):
+        return b''.join(self.encode(v) for v in values)
+
+    def decode_many(self, data, count, offset=0):
+        _zcl_check_length(data, offset + count, self.name)
+        values = []
+        for _ in range(count):
+            v, offset = self.decode(data, offset)
+            values.append(v)
+        return values, offset
+
+
+_count_struct = struct.Struct("<H")
+
+
+def _zcl_pack_count(count, name):
+    """
+    2 byte element/member count for array and struct
+    :raises ValueError: for more than 0xfffe; 0xffff is the "invalid" count
+    """
+    if count >= 0xffff:
+        raise ValueError("{} elements is too many for ZCL type {}".format(count, name))
+    return _count_struct.pack(count)
+
+
+class ZclArrayType:
+    """
+    Codec for the array type. The value is a tuple of (element type id, list of values); elements are encoded with encode_many
+    """
+    type_id = ZCL_ARRAY
+    name = "array"
+
+    def encode(self, value):
+        element_type_id, values = value
+        return zcl_type_byte(element_type_id) + _zcl_pack_count(len(values), self.name) + zcl_codec(element_type_id).encode_many(values)
+
+    def decode(self, data, offset=0):
+        _zcl_check_length(data, offset + 3, self.name)
+        element_type_id = data[offset]
+        count = _count_struct.unpack_from(data, offset + 1)[0]
+        values, offset = zcl_codec(element_type_id).decode_many(data, count, offset + 3)
+        return (element_type_id, values), offset
+
+    def encode_many(self, values):
+        return b''.join(self.encode(v) for v in values)
+
+    def decode_many(self, data, count, offset=0):
+        values = []
+        for _ in range(count):
+            v, offset = self.decode(data, offset)
+            values.append(v)
+        return values, offset
+
+
+class ZclStructType(ZclArrayType):
+    """
+    Codec for the structure type. The value is a list of (type id, value) tuples, one per member
+    """
+    type_id = ZCL_STRUCT
+    name = "struct"
+
+    def encode(self, value):
+        return _zcl_pack_count(len(value), self.name) + b''.join(zcl_value(t, v) for t, v in value)
+
+    def decode(self, data, offset=0):
+        _zcl_check_length(data, offset + 2, self.name)
+        count = _count_struct.unpack_from(data, offset)[0]
+        offset += 2
+        members = []
+        for _ in range(count):
+            _zcl_check_length(data, offset + 1, self.name)
+            member_type_id = data[offset]
+            v, offset = zcl_codec(member_type_id).decode(data, offset + 1)
+            members.append((member_type_id, v))
+        return members, offset
+
+
+def _build_zcl_codecs():
+    codecs = {ZCL_BOOLEAN: ZclBooleanType(),
+              ZCL_ENUM8: ZclFixedType(ZCL_ENUM8, "enum8", 1, "B"),
+              ZCL_ENUM16: ZclFixedType(ZCL_ENUM16, "enum16", 2, "H"),
+              ZCL_SEMI_FLOAT: ZclFixedType(ZCL_SEMI_FLOAT, "semi", 2, "e"),
+              ZCL_SINGLE_FLOAT: ZclFixedType(ZCL_SINGLE_FLOAT, "single", 4, "f"),
+              ZCL_DOUBLE_FLOAT: ZclFixedType(ZCL_DOUBLE_FLOAT, "double", 8, "d"),
+              ZCL_OCTET_STRING: ZclStringType(ZCL_OCTET_STRING, "octstr", 1, False),
+              ZCL_CHAR_STRING: ZclStringType(ZCL_CHAR_STRING, "string", 1, True),
+              ZCL_LONG_OCTET_STRING: ZclStringType(ZCL_LONG_OCTET_STRING, "octstr16", 2, False),
+              ZCL_LONG_CHAR_STRING: ZclStringType(ZCL_LONG_CHAR_STRING, "string16", 2, True),
+              ZCL_ARRAY: ZclArrayType(),
+              ZCL_STRUCT: ZclStructType()}
+    unsigned_fmt = {1: "B", 2: "H", 4: "I", 8: "Q"}
+    signed_fmt = {1: "b", 2: "h", 4: "i", 8: "q"}
+    for size in range(1, 9):
+        bits = size * 8
+        for base, name, fmts, signed in ((ZCL_DATA8, "data", unsigned_fmt, False),
+                                         (ZCL_BITMAP8, "map", unsigned_fmt, False),
+                                         (ZCL_UINT8, "uint", unsigned_fmt, False),
+                                         (ZCL_INT8, "int", signed_fmt, True)):
+            type_id = base + size - 1
+            codecs[type_id] = ZclFixedType(type_id, name + str(bits), size, fmts.get(size), signed)
+    return codecs
+
+
+ZCL_CODECS = _build_zcl_codecs()  # type id -> codec. Built once at import
+
+
+def zcl_codec(type_id):
+    """
+    :param type_id: ZCL data type id
+    :type type_id: int
+    :return: the codec object, with encode/decode/encode_many/decode_many methods
+    """
+    try:
+        return ZCL_CODECS[type_id]
+    except KeyError:
+        raise ValueError("Unsupported ZCL data type 0x{:02x}".format(type_id)) from None
+
+
+def zcl_type_byte(type_id):
+    return type_id.to_bytes(1, "big")
+
+
+def zcl_value(type_id, value):
+    """
+    Generate the data-type + value representation of a value for ZCL frames
+    :param type_id: ZCL data type id, e.g. ZCL_UINT16
+    :type type_id: int
+    :param value: int, float, bool, str, bytes or (for array/struct) see ZclArrayType/ZclStructType
+    :return: bytes
+    """
+    return zcl_type_byte(type_id) + zcl_codec(type_id).encode(value)
+
+
+def zcl_decode_value(data, offset=0):
+    """
+    Parse a data-type + value representation, as found in Write Attributes and Report Attributes frames
+    :param data:
+    :type data: bytes
+    :return: (type id, value, offset after the value)
+    """
+    _zcl_check_length(data, offset + 1, "data type")
+    type_id = data[offset]
+    value, offset = zcl_codec(type_id).decode(data, offset + 1)
+    return type_id, value, offset
+
+
+# ZCL attribute access control bits, as returned by Discover Attributes Extended
+ZCL_ACCESS_READ = 0x01
+ZCL_ACCESS_WRITE = 0x02
+ZCL_ACCESS_REPORT = 0x04
+
+# (cluster id, manufacturer code) -> provider class, populated by register_cluster. Both big-endian; the code is None for standard
+# attributes, so a cluster can have a standard and one or more manufacturer-specific attribute sets
+CLUSTER_PROVIDERS = {}
+
+
+class ZclAttributeIndex:
+    """
+    Sorted index of the attributes of one cluster, built once when the provider class is registered.
+    Read Attributes use dict lookups; Discover Attributes bisect the sorted ids to find the page start.
+    The fixed leading bytes of each response part are pre-computed, so responses are produced by joining slices.
+    """
+    def __init__(self, attributes):
+        """
+
+        :param attributes: big-endian attribute id -> (ZCL data type id, ZCL_ACCESS_* bits)
+        :type attributes: dict
+        """
+        self.ids = sorted(attributes)  # 2 byte big-endian bytes sort in numeric order
+        self.types = {a: attributes[a][0] for a in self.ids}
+        self.codecs = {a: zcl_codec(t) for a, t in self.types.items()}
+        # attribute id LE + status + data type, for Read Attributes Response. Reports have no status byte
+        self.read_prefixes = {a: a[::-1] + b'\x00' + zcl_type_byte(t) for a, t in self.types.items()}
+        self.report_prefixes = {a: a[::-1] + zcl_type_byte(t) for a, t in self.types.items()}
+        # attribute id LE + data type (+ access control for the extended form), in id order
+        self.discover_parts = [a[::-1] + zcl_type_byte(self.types[a]) for a in self.ids]
+        self.discover_extended_parts = [p + attributes[a][1].to_bytes(1, "big") for p, a in zip(self.discover_parts, self.ids)]
+        self.report_ids = tuple(a for a in self.ids if attributes[a][1] & ZCL_ACCESS_REPORT)  # those included in reports
+
+    def __contains__(self, attribute_id):
+        return attribute_id in self.types
+
+    def discover(self, start_attribute_id, max_count, extended=False):
+        """
+        Body for a Discover Attributes (Extended) Response: discovery-complete flag + up to max_count attributes with id >= start
+        :param start_attribute_id: big-endian attribute id
+        :type start_attribute_id: bytes
+        :param max_count: maximum number of attributes to return
+        :type max_count: int
+        :return: bytes
+        """
+        parts = self.discover_extended_parts if extended else self.discover_parts
+        lo = bisect_left(self.ids, start_attribute_id)
+        hi = min(lo + max_count, len(self.ids))
+        complete = b'\x01' if hi == len(self.ids) else b'\x00'
+        return complete + b''.join(parts[lo:hi])
+
+
+def register_cluster(cls):
+    """
+    Class decorator for attribute providers. Builds the attribute index from cls.attributes, sets supported_attributes
+    and reported_attributes (those with ZCL_ACCESS_REPORT; used for reports), in id order, and records the class in CLUSTER_PROVIDERS.
+    """
+    cls.attribute_index = ZclAttributeIndex(cls.attributes)
+    cls.supported_attributes = tuple(cls.attribute_index.ids)
+    cls.reported_attributes = cls.attribute_index.report_ids
+    CLUSTER_PROVIDERS[(cls.cluster_id, cls.manufacturer_code)] = cls
+    return cls
+
+
+class ZclClusterAttributeParts:
+    """
+    Base class for attribute providers. Sub-classes define cluster_id and attributes (see ZclAttributeIndex), are decorated with
+    @register_cluster and set self.values (attribute id -> value) in __init__.
+    """
+    cluster_id = None
+    manufacturer_code = None  # big-endian; set for a manufacturer-specific attribute set, which is only served to frames with this code
+    attributes = {}
+    attribute_index = None
+    supported_attributes = tuple()
+    reported_attributes = tuple()
+
+    def __init__(self, for_report=False):
+        """
+
+        :param for_report: True if for report. this affects the ZCL. Reports do not have the status byte. Attr request responses DO
+        """
+        self.for_report = for_report
+        self.values = {}
 
     def get_part(self, attribute_id):
         """
@@ -40,46 +429,74 @@ class BasicClusterAttributeParts:
         :type attribute_id: bytes
         :return:
         """
+        index = self.attribute_index
+        if attribute_id not in index:
+            return attribute_id[::-1] + b'\x86'  # status of 0x86 means UNSUPPORTED_ATTRIBUTE, and no value is included
+        prefix = index.report_prefixes[attribute_id] if self.for_report else index.read_prefixes[attribute_id]
+        return prefix + index.codecs[attribute_id].encode(self.values[attribute_id])
 
-        # we need the little-endian form for response messages, while working with big-endian for user-facing and Python API parameters
-        attribute_id_le = attribute_id[::-1]
 
-        # Default = use a status of 0x86, which means UNSUPPORTED_ATTRIBUTE and include no value
-        part = attribute_id_le + b'\x86'
+@register_cluster
+class BasicClusterAttributeParts(ZclClusterAttributeParts):
+    """
+    Produces the byte sequences for a Read Attributes Response Command, including the attribute identifier, status, data type, and value
+    """
+    cluster_id = b'\x00\x00'
+    # Z2M also requests ApplicationVersion (0x0001), StackVersion (0x0002), HWVersion (0x0003) and DateCode (0x0006), for which I will
+    # return a "not supported" (for now)
+    attributes = {b'\x00\x00': (ZCL_ENUM8, ZCL_ACCESS_READ),  # ZCL Version
+                  b'\x00\x04': (ZCL_CHAR_STRING, ZCL_ACCESS_READ),  # ManufacturerName
+                  b'\x00\x05': (ZCL_CHAR_STRING, ZCL_ACCESS_READ),  # ModelIdentifier
+                  b'\x00\x07': (ZCL_ENUM8, ZCL_ACCESS_READ),  # PowerSource. This is mandatory!
+                  # SWBuildID is optional according to Zigbee spec but Z2M logs an error without (although it is not breaking)
+                  # This might arise because the converter JS contains: "await endpoint.read('genBasic', ['modelId', 'swBuildId', 'powerSource']);"
+                  b'\x40\x00': (ZCL_CHAR_STRING, ZCL_ACCESS_READ),
+                  }
 
-        # Commented out elifs are those which are requested by Z2M but for which I will return a "not supported" (for now)
-        if attribute_id == b'\x00\x00':  # ZCL Version
-            part = attribute_id_le + b'\x00' + b'\x30' + b'\x08'  # - what should this be for HA 1.2????? Used 8 for now as latest ZCL doc (which is Z3!)
-        # elif attribute_id == b'\x00\x01':  # ApplicationVersion
-        #     pass
-        # elif attribute_id == b'\x00\x02':  # StackVersion
-        #     pass
-        # elif attribute_id == b'\x00\x03':  # HWVersion
-        #     pass
-        elif attribute_id == b'\x00\x04':
-            part = attribute_id_le + b'\x00' + zcl_string(self.manufacturer_name)
-        elif attribute_id == b'\x00\x05':
-            part = attribute_id_le + b'\x00' + zcl_string(self.model_identifier)
-        # elif attribute_id == b'\x00\x06':  # DateCode
-        #     pass
-        elif attribute_id == b'\x00\x07':  # PowerSource. This is mandatory!
-            part = attribute_id_le + b'\x00' + b'\x30' + b'\x03'  # last byte 0x00 means "unknown", 0x03 means "battery"
-        # SWBuildID is optional according to Zigbee spec but Z2M logs an error without (although it is not breaking)
-        # This might arise because the converter JS contains: "await endpoint.read('genBasic', ['modelId', 'swBuildId', 'powerSource']);"
-        elif attribute_id == b'\x40\x00':
-            part = attribute_id_le + b'\x00' + zcl_string(self.sw_build)
+    def __init__(self, model_identifier, manufacturer_name="ARC12", sw_build="test-build"):
+        # TODO allow more customisation here.
+        super(BasicClusterAttributeParts, self).__init__()
+        self.values = {b'\x00\x00': 8,  # - what should this be for HA 1.2????? Used 8 for now as latest ZCL doc (which is Z3!)
+                       b'\x00\x04': manufacturer_name,
+                       b'\x00\x05': model_identifier,
+                       b'\x00\x07': 3,  # 0x00 means "unknown", 0x03 means "battery"
+                       b'\x40\x00': sw_build}
+
+    # these write through to self.values, so that changes show in the next response
+    @property
+    def manufacturer_name(self):
+        return self.values[b'\x00\x04']
+
+    @manufacturer_name.setter
+    def manufacturer_name(self, value):
+        self.values[b'\x00\x04'] = value
+
+    @property
+    def model_identifier(self):
+        return self.values[b'\x00\x05']
+
+    @model_identifier.setter
+    def model_identifier(self, value):
+        self.values[b'\x00\x05'] = value
 
-        return part
+    @property
+    def sw_build(self):
+        return self.values[b'\x40\x00']
 
+    @sw_build.setter
+    def sw_build(self, value):
+        self.values[b'\x40\x00'] = value
 
-class OnOffReadAttributeParts:
+
+@register_cluster
+class OnOffReadAttributeParts(ZclClusterAttributeParts):
     """
     Produces the byte sequences for a Read Attributes Response Command, including the attribute identifier, status, data type, and value.
     Also for period reports.
     """
     cluster_id = b'\x00\x06'
-    supported_attributes = (b'\x00\x00',  # on/off
-                            )
+    attributes = {b'\x00\x00': (ZCL_BOOLEAN, ZCL_ACCESS_READ | ZCL_ACCESS_REPORT),  # on/off
+                  }
 
     def __init__(self, on_off_state, for_report=False):
         """
@@ -88,28 +505,145 @@ class OnOffReadAttributeParts:
         :type on_off_state: boolean
         :param for_report: True if for report. this affects the ZCL. Reports do not have the status byte. Attr request responses DO
         """
-        self.on_off_state = on_off_state
-        self.for_report = for_report
+        super(OnOffReadAttributeParts, self).__init__(for_report)
+        self.values = {b'\x00\x00': on_off_state}
 
-    def get_part(self, attribute_id):
+    @property
+    def on_off_state(self):
+        return self.values[b'\x00\x00']  # written through, so that changes show in the next response or report
+
+    @on_off_state.setter
+    def on_off_state(self, value):
+        self.values[b'\x00\x00'] = value
+
+
+@register_cluster
+class TemperatureMeasurementAttributeParts(ZclClusterAttributeParts):
+    """
+    Produces the byte sequences for a Read Attributes Response Command or report for the Temperature Measurement cluster.
+    Temperatures are in degrees C and are sent as int16 in units of 0.01 degree.
+    """
+    cluster_id = b'\x04\x02'
+    attributes = {b'\x00\x00': (ZCL_INT16, ZCL_ACCESS_READ | ZCL_ACCESS_REPORT),  # MeasuredValue
+                  b'\x00\x01': (ZCL_INT16, ZCL_ACCESS_READ),  # MinMeasuredValue
+                  b'\x00\x02': (ZCL_INT16, ZCL_ACCESS_READ),  # MaxMeasuredValue
+                  }
+
+    def __init__(self, measured_value, min_measured_value=None, max_measured_value=None, for_report=False):
         """
 
-        :param attribute_id: big-endian attribute id
-        :type attribute_id: bytes
-        :return:
+        :param measured_value: degrees C, or None if unknown
+        :type measured_value: float
+        :param min_measured_value: degrees C, or None if unknown
+        :param max_measured_value: degrees C, or None if unknown
+        :param for_report: True if for report. this affects the ZCL. Reports do not have the status byte. Attr request responses DO
+        """
+        super(TemperatureMeasurementAttributeParts, self).__init__(for_report)
+        self.values = {}
+        self.measured_value = measured_value
+        self.min_measured_value = min_measured_value
+        self.max_measured_value = max_measured_value
+
+    # these convert degrees C to/from the int16 in self.values, so that changes show in the next response or report.
+    # 0x8000 means "invalid" or unknown
+    def _get_degrees(self, attribute_id):
+        v = self.values[attribute_id]
+        return None if v == -0x8000 else v / 100
+
+    def _set_degrees(self, attribute_id, degrees):
+        self.values[attribute_id] = -0x8000 if degrees is None else round(degrees * 100)
+
+    @property
+    def measured_value(self):
+        return self._get_degrees(b'\x00\x00')
+
+    @measured_value.setter
+    def measured_value(self, degrees):
+        self._set_degrees(b'\x00\x00', degrees)
+
+    @property
+    def min_measured_value(self):
+        return self._get_degrees(b'\x00\x01')
+
+    @min_measured_value.setter
+    def min_measured_value(self, degrees):
+        self._set_degrees(b'\x00\x01', degrees)
+
+    @property
+    def max_measured_value(self):
+        return self._get_degrees(b'\x00\x02')
+
+    @max_measured_value.setter
+    def max_measured_value(self, degrees):
+        self._set_degrees(b'\x00\x02', degrees)
+
+
+@register_cluster
+class SimpleMeteringAttributeParts(ZclClusterAttributeParts):
+    """
+    Produces the byte sequences for a Read Attributes Response Command or report for the Metering cluster, set up for electrical
+    energy: summation in kWh and demand in kW, each scaled by multiplier/divisor.
+    """
+    cluster_id = b'\x07\x02'
+    attributes = {b'\x00\x00': (ZCL_UINT48, ZCL_ACCESS_READ | ZCL_ACCESS_REPORT),  # CurrentSummationDelivered
+                  b'\x03\x00': (ZCL_ENUM8, ZCL_ACCESS_READ),  # UnitofMeasure
+                  b'\x03\x01': (ZCL_UINT24, ZCL_ACCESS_READ),  # Multiplier
+                  b'\x03\x02': (ZCL_UINT24, ZCL_ACCESS_READ),  # Divisor
+                  b'\x03\x03': (ZCL_BITMAP8, ZCL_ACCESS_READ),  # SummationFormatting
+                  b'\x03\x06': (ZCL_BITMAP8, ZCL_ACCESS_READ),  # MeteringDeviceType
+                  b'\x04\x00': (ZCL_INT24, ZCL_ACCESS_READ | ZCL_ACCESS_REPORT),  # InstantaneousDemand
+                  }
+
+    def __init__(self, summation_delivered, instantaneous_demand, multiplier=1, divisor=1000, for_report=False):
+        """
+
+        :param summation_delivered: raw counter value, in kWh * divisor / multiplier (i.e. Wh for the defaults)
+        :type summation_delivered: int
+        :param instantaneous_demand: raw value, in kW * divisor / multiplier (i.e. W for the defaults)
+        :type instantaneous_demand: int
+        :param for_report: True if for report. this affects the ZCL. Reports do not have the status byte. Attr request responses DO
         """
-        status_byte = b'' if self.for_report else b'\x00'  # success
+        super(SimpleMeteringAttributeParts, self).__init__(for_report)
+        self.values = {b'\x00\x00': summation_delivered,
+                       b'\x03\x00': 0x00,  # kWh (and kW)
+                       b'\x03\x01': multiplier,
+                       b'\x03\x02': divisor,
+                       b'\x03\x03': 0x00,
+                       b'\x03\x06': 0x00,  # electric metering
+                       b'\x04\x00': instantaneous_demand}
 
-        # we need the little-endian form for response messages, while working with big-endian for user-facing and Python API parameters
-        attribute_id_le = attribute_id[::-1]
+    # these write through to self.values, so that changes show in the next response or report
+    @property
+    def summation_delivered(self):
+        return self.values[b'\x00\x00']
 
-        # Default = use a status of 0x86, which means UNSUPPORTED_ATTRIBUTE and include no value
-        part = attribute_id_le + b'\x86'
+    @summation_delivered.setter
+    def summation_delivered(self, value):
+        self.values[b'\x00\x00'] = value
 
-        if attribute_id == b'\x00\x00':
-            part = attribute_id_le + status_byte + b'\x10' + self.on_off_state.to_bytes(1, "big")  # data type 0x10 is boolean
+    @property
+    def multiplier(self):
+        return self.values[b'\x03\x01']
 
-        return part
+    @multiplier.setter
+    def multiplier(self, value):
+        self.values[b'\x03\x01'] = value
+
+    @property
+    def divisor(self):
+        return self.values[b'\x03\x02']
+
+    @divisor.setter
+    def divisor(self, value):
+        self.values[b'\x03\x02'] = value
+
+    @property
+    def instantaneous_demand(self):
+        return self.values[b'\x04\x00']
+
+    @instantaneous_demand.setter
+    def instantaneous_demand(self, value):
+        self.values[b'\x04\x00'] = value
 
 
 def zcl_string(s):
@@ -118,7 +652,7 @@ def zcl_string(s):
     :param s:
     :return:
     """
-    return b'\x42' + len(s).to_bytes(length=1, byteorder="big") + s.encode(encoding="ascii")
+    return zcl_value(ZCL_CHAR_STRING, s)
 
 
 def zcl_fcf_flip(fcf):
@@ -140,30 +674,43 @@ class ZclFrameCommand:
         :type data: bytes
         :
         """
+        # if the manufacturer-specific bit (2) of the FCF is set, a 2 byte manufacturer code comes between the FCF and the sequence no
+        self.manufacturer_code = None  # big-endian, when present
+        self.payload_offset = 3  # where the command payload starts
+        if data and data[0] & 0x04:
+            self.payload_offset = 5
+        if len(data) < self.payload_offset:
+            raise ValueError("ZCL frame too short for its header: " + data.hex(sep=' '))
+        if self.payload_offset == 5:
+            self.manufacturer_code = data[2:0:-1]
         self.frame_control = data[0].to_bytes(length=1, byteorder="big")
-        self.trans_seq_no = data[1].to_bytes(length=1, byteorder="big")  # NB as byte as this will be needed for replies
-        self.zcl_command = data[2].to_bytes(length=1, byteorder="big")
+        self.trans_seq_no = data[self.payload_offset - 2].to_bytes(length=1, byteorder="big")  # NB as byte as this will be needed for replies
+        self.zcl_command = data[self.payload_offset - 1].to_bytes(length=1, byteorder="big")
 
 
 class ZclFrameResponse:
     """
     Base class for a response to a ZNP message
     """
-    def __init__(self, frame_control, trans_seq_no, zcl_command):
+    def __init__(self, frame_control, trans_seq_no, zcl_command, manufacturer_code=None):
         """
-        Params are all 1 byte length bytes objects
+        Params are all 1 byte length bytes objects, except for manufacturer_code
         :param frame_control:
         :type frame_control: bytes
         :param trans_seq_no:
         :param zcl_command:
+        :param manufacturer_code: big-endian 2 byte code for a manufacturer-specific frame (FCF bit 2 set), otherwise None
         """
         self.frame_control = frame_control
         self.trans_seq_no = trans_seq_no
         self.zcl_command = zcl_command
+        self.manufacturer_code = manufacturer_code
         self.variables = []  # populate this in sub-class. this is the list of items for the message body
 
     def zcl_header(self):
-        return self.frame_control + self.trans_seq_no + self.zcl_command
+        if self.manufacturer_code is None:
+            return self.frame_control + self.trans_seq_no + self.zcl_command
+        return self.frame_control + self.manufacturer_code[::-1] + self.trans_seq_no + self.zcl_command
 
     def zcl_message(self):
         """
@@ -186,7 +733,7 @@ class ZclFrameReadAttributes(ZclFrameCommand):
         super(ZclFrameReadAttributes, self).__init__(data)
 
         self.attribute_ids = []  # converted to big-endian from little-endian in the raw data
-        for i in range(3, len(data), 2):
+        for i in range(self.payload_offset, len(data), 2):
             self.attribute_ids.append(data[i+1: i-1: -1])
 
 
@@ -201,11 +748,51 @@ class ZclFrameReadAttributesResponse(ZclFrameResponse):
         :type response_to: ZclFrameReadAttributes
         :param cluster_provider: object with get_part(attribute_id) method, which will generate the data parts for the response
         """
-        super(ZclFrameReadAttributesResponse, self).__init__(zcl_fcf_flip(response_to.frame_control), response_to.trans_seq_no, b'\x01')
+        super(ZclFrameReadAttributesResponse, self).__init__(zcl_fcf_flip(response_to.frame_control), response_to.trans_seq_no, b'\x01',
+                                                             response_to.manufacturer_code)
 
         self.variables = [cluster_provider.get_part(a) for a in response_to.attribute_ids]
 
 
+class ZclFrameDiscoverAttributes(ZclFrameCommand):
+    """
+    Parses a Discover Attributes (0x0c) or Discover Attributes Extended (0x15) command: start attribute id + maximum count
+    """
+    def __init__(self, data):
+        """
+
+        :param data: "data" component of e.g. AF_INCOMING_MSG
+        :type data: bytes
+        """
+        super(ZclFrameDiscoverAttributes, self).__init__(data)
+
+        i = self.payload_offset
+        if len(data) < i + 3:
+            raise ValueError("Discover attributes payload too short: " + data.hex(sep=' '))
+        self.start_attribute_id = data[i + 1:i - 1:-1]  # converted to big-endian from little-endian in the raw data
+        self.max_count = data[i + 2]
+        self.extended = self.zcl_command == b'\x15'
+
+
+class ZclFrameDiscoverAttributesResponse(ZclFrameResponse):
+    """
+    Creates a response to discover-attributes or discover-attributes-extended, from the cluster's attribute index
+    """
+    def __init__(self, response_to, attribute_index):
+        """
+
+        :param response_to: ZCL command frame object
+        :type response_to: ZclFrameDiscoverAttributes
+        :param attribute_index: e.g. cluster_provider.attribute_index
+        :type attribute_index: ZclAttributeIndex
+        """
+        # 0x0d is "discover attributes response", 0x16 is the extended form
+        super(ZclFrameDiscoverAttributesResponse, self).__init__(zcl_fcf_flip(response_to.frame_control), response_to.trans_seq_no,
+                                                                 b'\x16' if response_to.extended else b'\x0d', response_to.manufacturer_code)
+
+        self.variables = [attribute_index.discover(response_to.start_attribute_id, response_to.max_count, response_to.extended)]
+
+
 class ZclFrameReport(ZclFrameResponse):
     """
     Creates report ZCL (very similar to response to read-attributes command)
@@ -213,11 +800,12 @@ class ZclFrameReport(ZclFrameResponse):
     def __init__(self, cluster_provider, sequence_no):
         """
 
-        :param cluster_provider: object with get_part(attribute_id) method, which will generate the data parts for the response
+        :param cluster_provider: object with get_part(attribute_id) method and reported_attributes, which will generate the data
+        parts for the report
         """
         super(ZclFrameReport, self).__init__(b'\x18', sequence_no.to_bytes(1, "big"), b'\x0a')
 
-        self.variables = [cluster_provider.get_part(a) for a in cluster_provider.supported_attributes]
+        self.variables = [cluster_provider.get_part(a) for a in cluster_provider.reported_attributes]
 
 
 class ZclFrameDefaultResponse(ZclFrameResponse):
@@ -240,6 +828,7 @@ class AfIncomingMessage:
     AF_INCOMING_MESSAGE is Simple API
     This will handle both attribute requests and "local/cluster-specific" commands (have no attributes), in spite of the use of ZclFrameReadAttributes
     for self.zcl (in the local case, this is an empty list for messages I've seen so far).
+    If the ZCL is too short for its header, self.zcl is None and self.zcl_error says why, rather than raising.
     """
     def __init__(self, f):
         """
@@ -267,7 +856,12 @@ class AfIncomingMessage:
         self.transaction_seq_no = f.data[15].to_bytes(length=1, byteorder="big")
         self.data_len = f.data[16]  # somewhat redundant as a public property
         self.zcl_raw = f.data[17:17+self.data_len]  # oddly, the raw frame data has 3 extra bytes after those indicated by data_len, which don't show in sniffer
-        self.zcl = ZclFrameReadAttributes(self.zcl_raw)
+        self.zcl = None
+        self.zcl_error = None
+        try:
+            self.zcl = ZclFrameReadAttributes(self.zcl_raw)
+        except ValueError as e:
+            self.zcl_error = str(e)
 
 
 class ZnpFrameBody:  # i.e. the ZNP frame as sent over UART but without the SOF byte and the FCS byte. Length becomes implicit in len(self.data)